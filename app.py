@@ -1,8 +1,34 @@
+import os
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
-import plotly.express as px
+import plotly.graph_objects as go
 import streamlit as st
 
+# USE_POLARS 设为 1/true/yes 时，筛选与分组统计改由 Polars 执行
+USE_POLARS = os.environ.get('USE_POLARS', '').strip().lower() in ('1', 'true', 'yes')
+if USE_POLARS:
+    try:
+        import polars as pl
+    except ImportError as e:
+        raise ImportError("已设置 USE_POLARS 环境变量，但未安装 polars，请先执行 pip install polars") from e
+
 # 常量定义
+DATA_CSV = 'game_analysis.csv'
+DATA_PARQUET = 'game_analysis.parquet'
+CSV_DTYPES = {
+    '颜色': 'int8',
+    '轮次': 'int16',
+    '花费': 'int16',
+    '胜负': 'category',
+    'CODE': 'category',
+    '玩家': 'category',
+    '中文名': 'category',
+    **{col: 'string[pyarrow]' for col in ['组别', '卡牌', '行为', '先后']}
+}
+MAX_BARS = 200
+
 COLOR_MAPPING = {
     4: '奇迹',
     8: '行动',
@@ -100,61 +126,200 @@ render_config()
 class GameAnalyze:
     def __init__(self):
         self.df = self._load_df()
-        self.multi_filters = {col: self.df[col].unique() for col in ['组别', '类型', '卡名', '行为', '先后', '玩家']}
-        self.range_filters = {col: (self.df[col].min(), self.df[col].max()) for col in ['轮次', '花费']}
+        self.multi_filters = {
+            col: self.df[col].cat.categories.tolist() if hasattr(self.df[col], 'cat')
+            else sorted(self.df[col].unique().tolist())
+            for col in ['组别', '类型', '卡名', '行为', '先后', '玩家']
+        }
+        self.range_filters = {col: (int(self.df[col].min()), int(self.df[col].max())) for col in ['轮次', '花费']}
+        self.pl = pl.from_pandas(self.df).lazy() if USE_POLARS else None
 
     @staticmethod
     def _load_df():
-        dtypes = {
-            '颜色': 'int8',
-            '轮次': 'int16',
-            '花费': 'int16',
-            '胜负': 'category',
-            'CODE': 'category',
-            '玩家': 'category',
-            '中文名': 'category'
-        }
-        df = pd.read_csv('game_analysis.csv', dtype=dtypes)
-        df['类型'] = df['颜色'].map(COLOR_MAPPING).astype('category')
+        df = GameAnalyze._read_parquet()
+        if df is None:
+            df = GameAnalyze._convert_csv()
+        # 颜色取值很少，用查找表直接得到类型的分类编码；表外的颜色记为缺失
+        lut = np.full(max(COLOR_MAPPING) + 1, -1, dtype=np.int8)
+        lut[list(COLOR_MAPPING)] = np.arange(len(COLOR_MAPPING))
+        colors = df['颜色'].to_numpy()
+        in_range = (colors >= 0) & (colors < len(lut))
+        codes = np.where(in_range, lut[np.where(in_range, colors, 0)], -1)
+        df['类型'] = pd.Categorical.from_codes(codes, categories=list(COLOR_MAPPING.values()))
         df = df.rename(columns={'中文名': '卡名'})
+        # 每局每位玩家 (CODE, 玩家) 预先编号，分组统计时按编号去重
+        df['_pair'] = pd.factorize(
+            df['CODE'].cat.codes.to_numpy(np.int64) * len(df['玩家'].cat.categories) + df['玩家'].cat.codes.to_numpy()
+        )[0]
+        df['_win'] = (df['胜负'].astype(str) == '赢').astype(np.uint8)
+        return df
+
+    @staticmethod
+    def _read_parquet():
+        # 缓存不存在、早于CSV或列类型与 CSV_DTYPES 不一致时视为失效，返回 None
+        if not os.path.exists(DATA_PARQUET) or (
+                os.path.exists(DATA_CSV) and os.path.getmtime(DATA_PARQUET) < os.path.getmtime(DATA_CSV)):
+            return None
+        df = pd.read_parquet(DATA_PARQUET)
+        if any(col not in df.columns or df[col].dtype != dtype for col, dtype in CSV_DTYPES.items()):
+            return None
+        return df
+
+    @staticmethod
+    def _convert_csv():
+        # 首次运行时将CSV转为Parquet，之后冷启动直接读取带类型的Parquet
+        df = pd.read_csv(DATA_CSV, dtype=CSV_DTYPES, engine='pyarrow')
+        try:
+            df.to_parquet(DATA_PARQUET, compression='snappy')
+        except OSError:
+            pass
         return df
 
 @st.cache_data(ttl=3600, show_spinner=False)
-def cached_filter(df, **kwargs):
+def cached_filter(_ga, **kwargs):
+    # _ga 为全局唯一的 GameAnalyze，不参与缓存键哈希
+    active = active_filters(kwargs)
+    if not active:
+        return _ga.df
     with st.spinner("正在处理数据，请稍候..."):
-        filter_mask = pd.Series(True, index=df.index)
-        for col, (filter_type, values) in kwargs.items():
+        if USE_POLARS:
+            return cached_filter_polars(_ga, **active).to_pandas()
+        masks = []
+        for col, (filter_type, values) in active.items():
             if filter_type == 'multi':
-                if values:
-                    filter_mask &= df[col].isin(values)
+                masks.append(isin_mask(_ga.df[col], values))
             elif filter_type == 'range':
-                filter_mask &= df[col].between(*values)
-        return df[filter_mask]
+                masks.append(range_mask(_ga.df[col], *values))
+        return _ga.df.iloc[np.logical_and.reduce(masks)]
+
+def active_filters(filter_args):
+    # 未选择的多选项 ([]) 和覆盖全范围的滑块 (None) 不参与筛选
+    return {col: (filter_type, values) for col, (filter_type, values) in filter_args.items() if values}
 
 @st.cache_data(ttl=3600, show_spinner=False)
-def cached_groupby(df, dimensions):
+def cached_filter_polars(_ga, **active):
+    # 筛选结果以 Polars 表缓存，cached_filter 与 cached_groupby 共用，只筛选一次
+    return _ga.pl.filter(polars_filter(active)).collect()
+
+def polars_filter(active):
+    return pl.all_horizontal(
+        pl.col(col).is_in(values) if filter_type == 'multi' else pl.col(col).is_between(*values)
+        for col, (filter_type, values) in active.items()
+    )
+
+def isin_mask(series, values):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # 在整数编码上比较，避免逐个字符串哈希
+        selected = series.cat.categories.get_indexer(values)
+        return np.isin(series.cat.codes.to_numpy(), selected[selected >= 0])
+    return series.isin(values).to_numpy()
+
+def range_mask(series, low, high):
+    arr = series.to_numpy()
+    return (arr >= low) & (arr <= high)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_groupby(_ga, filter_args, dimensions):
+    # 以筛选条件代替筛选后的整表作为缓存键
     with st.spinner("正在处理数据，请稍候..."):
-        result = df.groupby(dimensions).apply(calculate_stats).reset_index()
+        if USE_POLARS:
+            active = active_filters(filter_args)
+            lf = cached_filter_polars(_ga, **active).lazy() if active else _ga.pl
+            result = calculate_stats_polars(lf, dimensions)
+        else:
+            result = calculate_stats(cached_filter(_ga, **filter_args), dimensions)
         result = result[result.总场数 > 0]
         return result
 
-def calculate_stats(group):
-    base_groups = {
-        '总场': pd.Series(True, index=group.index),
-        '胜场': group['胜负'].eq('赢'),
-        '负场': group['胜负'].ne('赢')
-    }
-    unique_counts = {
-        name: group.loc[mask, ['CODE', '玩家']].drop_duplicates().shape[0]
-        for name, mask in base_groups.items()
+def calculate_stats(df, dimensions):
+    all_codes = []
+    levels = []
+    for col in dimensions:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            # 分类列直接使用已有编码，无需再次哈希
+            codes = df[col].cat.codes.to_numpy()
+            uniques = pd.CategoricalIndex(df[col].cat.categories, dtype=df[col].dtype)
+        else:
+            codes, uniques = pd.factorize(df[col])
+        all_codes.append(codes)
+        levels.append(uniques)
+    # 任一维度缺失 (编码 -1) 的行不参与分组，与 groupby(dropna=True) 一致
+    valid = np.logical_and.reduce([codes >= 0 for codes in all_codes])
+    if not valid.all():
+        df = df[valid]
+        all_codes = [codes[valid] for codes in all_codes]
+    # 将多维分组键合并为单个整数编号
+    key = np.zeros(len(df), dtype=np.int64)
+    for codes, uniques in zip(all_codes, levels):
+        key = key * len(uniques) + codes
+    group_id, group_keys = pd.factorize(key)
+    n = len(group_keys)
+    # 同一局同一玩家在分组内只计一次，胜负对 (CODE, 玩家) 恒定
+    first = ~pd.DataFrame({'group': group_id, 'pair': df['_pair'].to_numpy()}).duplicated().to_numpy()
+    win = df['_win'].to_numpy()
+
+    result = {}
+    rest = group_keys
+    for col, uniques in reversed(list(zip(dimensions, levels))):
+        rest, codes = np.divmod(rest, len(uniques))
+        result[col] = uniques.take(codes)
+    result = pd.DataFrame({col: result[col] for col in dimensions})
+    total = np.bincount(group_id[first], minlength=n)
+    wins = np.bincount(group_id[first & win.view(bool)], minlength=n)
+    result['胜率'] = wins / total
+    result['总场数'] = total
+    result['胜场数'] = wins
+    result['负场数'] = total - wins
+    # 负场 = 总场 - 胜场，每个统计量只需两次累加
+    rows = np.bincount(group_id, minlength=n)
+    win_rows = np.bincount(group_id, weights=win, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for stat in ['轮次', '花费']:
+            values = df[stat].to_numpy(dtype=np.float64)
+            sums = np.bincount(group_id, weights=values, minlength=n)
+            win_sums = np.bincount(group_id, weights=values * win, minlength=n)
+            result[f'总场平均{stat}'] = sums / rows
+            result[f'胜场平均{stat}'] = win_sums / win_rows
+            result[f'负场平均{stat}'] = (sums - win_sums) / (rows - win_rows)
+    return result
+
+def calculate_stats_polars(lf, dimensions):
+    win = pl.col('_win') == 1
+    counts = lf.unique(subset=dimensions + ['_pair']).group_by(dimensions).agg(
+        pl.len().cast(pl.Int64).alias('总场数'),
+        pl.col('_win').sum().cast(pl.Int64).alias('胜场数')
+    )
+    means = lf.group_by(dimensions).agg(
+        expr
+        for stat in ['轮次', '花费']
+        for expr in [
+            pl.col(stat).mean().alias(f'总场平均{stat}'),
+            pl.col(stat).filter(win).mean().alias(f'胜场平均{stat}'),
+            pl.col(stat).filter(~win).mean().alias(f'负场平均{stat}')
+        ]
+    )
+    result = counts.join(means, on=dimensions).with_columns(
+        (pl.col('胜场数') / pl.col('总场数')).alias('胜率'),
+        (pl.col('总场数') - pl.col('胜场数')).alias('负场数')
+    )
+    return result.select(
+        *dimensions, '胜率', '总场数', '胜场数', '负场数',
+        *[f'{k}平均{stat}' for stat in ['轮次', '花费'] for k in ['总场', '胜场', '负场']]
+    ).collect().to_pandas()
+
+def join_dimensions(result, dimensions):
+    cols = [result[col].astype(str) for col in dimensions]
+    if len(cols) == 1:
+        return cols[0]
+    return cols[0].str.cat(cols[1:], sep=' - ')
+
+@lru_cache(maxsize=None)
+def table_format(columns):
+    return {
+        '胜率': '{:.1%}',
+        **{col: '{:.0f}' for col in columns if col[-1] == '数'},
+        **{col: '{:.1f}' for col in columns if '平均' in col}
     }
-    return pd.Series({
-        '胜率': unique_counts['胜场'] / unique_counts['总场'] if unique_counts['总场'] > 0 else 0,
-        **{f'{k}数': v for k, v in unique_counts.items()},
-        **{f'{k}平均{stat}': group.loc[mask, stat].mean()
-           for stat in ['轮次', '花费']
-           for k, mask in base_groups.items()},
-    })
 
 def render_table(result):
     styled_df = result.style.background_gradient(
@@ -162,24 +327,39 @@ def render_table(result):
         cmap='RdYlGn',
         vmin=0,
         vmax=1
-    ).format({
-        '胜率': '{:.1%}',
-        **{col: '{:.0f}' for col in result.columns if col[-1] == '数'},
-        **{col: '{:.1f}' for col in result.columns if '平均' in col}
-    }).hide(['维度组合'], axis=1)
+    ).format(table_format(tuple(result.columns)))
     st.dataframe(styled_df, height=400, use_container_width=True, hide_index=True)
 
-def render_graph(df):
-    fig = px.bar(
-        df,
-        x='维度组合',
-        y='胜率',
-        color='胜率',
-        color_continuous_scale='RdYlGn',
-        range_color=[0, 1],
-        title="胜率分布图"
-    )
+def render_graph(df, dimensions):
+    # 结果已按排序依据排好，只绘制前 MAX_BARS 组
+    total_groups = len(df)
+    df = df.head(MAX_BARS)
+    labels = join_dimensions(df, dimensions).to_numpy()
+    win_rate = df['胜率'].to_numpy()
+    fig = go.Figure(go.Bar(
+        x=labels,
+        y=win_rate,
+        marker=dict(
+            color=win_rate,
+            colorscale='RdYlGn',
+            cmin=0,
+            cmax=1,
+            colorbar=dict(title='胜率')
+        ),
+        customdata=np.stack([df['总场数'].to_numpy(), df['胜场数'].to_numpy()], axis=1),
+        hovertemplate=(
+            "<b>%{x}</b><br>"
+            "胜率: %{y:.1%}<br>"
+            "总场数: %{customdata[0]}<br>"
+            "胜场数: %{customdata[1]}"
+            "<extra></extra>"
+        ),
+        text=[f"{x:.1%}" for x in win_rate] if len(df) < 100 else None,
+        textposition='inside',
+        textfont=dict(size=12, color='#333')
+    ))
     fig.update_layout(
+        title="胜率分布图",
         plot_bgcolor='rgba(0,0,0,0)',
         paper_bgcolor='rgba(0,0,0,0)',
         hoverlabel=dict(bgcolor="white", font_size=14),
@@ -187,22 +367,9 @@ def render_graph(df):
         yaxis=dict(showgrid=True, gridcolor='#ecf0f1', linecolor='#bdc3c7'),
         margin=dict(l=20, r=20, t=40, b=20)
     )
-    if len(df) < 100:
-        fig.update_traces(
-            text=df['胜率'].apply(lambda x: f"{x:.1%}"),
-            textposition='inside',
-            textfont=dict(size=12, color='#333')
-        )
-    fig.update_traces(
-        hovertemplate=(
-            "<b>%{x}</b><br>"
-            "胜率: %{y:.1%}<br>"
-            "总场数: %{customdata[0]}<br>"
-            "胜场数: %{customdata[1]}"
-        ),
-        customdata=df[['总场数', '胜场数']].values
-    )
     st.plotly_chart(fig, use_container_width=True)
+    if total_groups > MAX_BARS:
+        st.caption(f"仅显示前 {MAX_BARS} 组，共 {total_groups} 组")
 
 def render_pagination(result, page_size, control):
     total_pages = (len(result) - 1) // page_size + 1
@@ -214,20 +381,21 @@ def render_pagination(result, page_size, control):
 def render_filter(ga: GameAnalyze):
     # 侧边栏筛选
     st.sidebar.header("筛选条件")
-    df = ga.df.copy()
     filter_args = dict()
     for col, multi_filter in ga.multi_filters.items():
         filter_args[col] = 'multi', st.sidebar.multiselect(col, multi_filter)
     for col, (min_value, max_value) in ga.range_filters.items():
-        filter_args[col] = 'range', st.sidebar.slider(
+        value = st.sidebar.slider(
             f'{col}范围',
-            min_value=int(min_value),
-            max_value=int(max_value),
-            value=(int(min_value), int(max_value))
+            min_value=min_value,
+            max_value=max_value,
+            value=(min_value, max_value)
         )
-    return cached_filter(df, **filter_args)
+        # 全范围等同于不筛选，统一为 None 以共用缓存
+        filter_args[col] = 'range', None if value == (min_value, max_value) else value
+    return cached_filter(ga, **filter_args), filter_args
 
-def render_main(df):
+def render_main(ga: GameAnalyze, df, filter_args):
     st.title("🎮 卡牌胜率统计分析")
     st.subheader("统计范围：Royal League S1-S3, Premier League S1-S4")
     control_cols = st.columns([2, 2, 4, 2, 2])
@@ -239,20 +407,19 @@ def render_main(df):
         sort_order = control_cols[3].selectbox('排序依据', ['胜率', '总场数', '胜场数'])
         sort_type = control_cols[4].selectbox('排序方式', ['降序', '升序'])
         if selected_dimensions:
-            result = cached_groupby(df, selected_dimensions)
-            result['维度组合'] = result[selected_dimensions].apply(lambda x: ' - '.join(x.astype(str)), axis=1)
+            result = cached_groupby(ga, filter_args, selected_dimensions)
             result = result.sort_values(by=sort_order, ascending=sort_type == '升序')
     if not result.empty:
         paginated_result = render_pagination(result, page_size, control_cols[1])
         render_table(paginated_result)
-        render_graph(result)
+        render_graph(result, selected_dimensions)
         if st.checkbox('显示原始数据'):
-            st.write(df)
+            st.write(df.drop(columns=[col for col in df.columns if col.startswith('_')]))
     else:
         st.warning('当前筛选条件下无数据')
 
 def render(ga: GameAnalyze):
-    df = render_filter(ga)
-    render_main(df)
+    df, filter_args = render_filter(ga)
+    render_main(ga, df, filter_args)
 
 render(GameAnalyze())
\ No newline at end of file